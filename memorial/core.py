@@ -8,12 +8,14 @@ from abc import abstractmethod
 from collections.abc import Generator, Sequence
 from typing import Any
 
-from prefetch_generator import prefetch
+from memorial.utils import prefetch_iter
 
 
 class ReplayBuffer:
     """Base replay buffer class."""
 
+    __slots__ = ("mem_size", "count", "memory", "__weakref__")
+
     def __init__(self, mem_size: int):
         """__init__.
 
@@ -78,7 +80,7 @@ class ReplayBuffer:
         Returns:
             int:
         """
-        return sum([d.nbytes for d in self.memory])
+        return sum(d.nbytes for d in self.memory)
 
     @property
     def is_full(self) -> bool:
@@ -102,12 +104,12 @@ class ReplayBuffer:
         """
         assert type(other) is type(self)
 
+        num_items = len(other)
         self.push(
-            [m[: len(other)] for m in other.memory],
+            [m[:num_items] for m in other.memory],
             bulk=True,
         )
 
-    @prefetch(max_prefetch=1)
     def iter_sample(
         self, batch_size: int, num_iter: int
     ) -> Generator[Sequence[Any]]:  # pyright: ignore[reportGeneralTypeIssues]
@@ -121,8 +123,9 @@ class ReplayBuffer:
             Generator[Sequence[np.ndarray | torch.Tensor], None, None]:
 
         """
-        for _ in range(num_iter):
-            yield (self.sample(batch_size=batch_size))
+        return prefetch_iter(
+            self.sample(batch_size=batch_size) for _ in range(num_iter)
+        )
 
     @abstractmethod
     def sample(self, batch_size: int) -> Sequence[Any]:
@@ -140,13 +143,15 @@ class ReplayBuffer:
     @abstractmethod
     def push(
         self,
-        data: Sequence[Any],
+        data: tuple[Any, ...] | list[Any],
         bulk: bool = False,
     ) -> None:
         """push.
 
+        Tuples are the preferred container for `data`, as they are the cheapest to build and iterate over.
+
         Args:
-            data (Sequence[Any]): data
+            data (tuple[Any, ...] | list[Any]): data
             bulk (bool): bulk
 
         Returns:
@@ -172,6 +177,11 @@ class ReplayBuffer:
 class ReplayBufferWrapper(ReplayBuffer):
     """ReplayBufferWrapper."""
 
+    __slots__ = ("base_buffer", "_base_push", "_base_sample")
+
+    # whether the warning on accessing `memory` has been emitted
+    _warned_memory_access = False
+
     def __init__(self, base_buffer: ReplayBuffer):
         """__init__.
 
@@ -182,6 +192,10 @@ class ReplayBufferWrapper(ReplayBuffer):
         self.base_buffer = base_buffer
         self.mem_size = base_buffer.mem_size
 
+        # bound methods of the base buffer, saves the attribute lookups on every push and sample
+        self._base_push = base_buffer.push
+        self._base_sample = base_buffer.sample
+
     @property
     def count(self) -> int:
         """The number of transitions that's been through this buffer."""
@@ -190,13 +204,21 @@ class ReplayBufferWrapper(ReplayBuffer):
     @property
     def memory(self) -> list[Any]:
         """The core memory of this buffer."""
-        warnings.warn(
-            "Accessing the core of `ReplayBufferWrapper` returns the "
-            "memory of the base buffer, not the wrapped buffer",
-            category=RuntimeWarning,
-        )
+        if not ReplayBufferWrapper._warned_memory_access:
+            ReplayBufferWrapper._warned_memory_access = True
+            warnings.warn(
+                "Accessing the core of `ReplayBufferWrapper` returns the "
+                "memory of the base buffer, not the wrapped buffer",
+                category=RuntimeWarning,
+                stacklevel=2,
+            )
         return self.base_buffer.memory
 
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes that the base buffer is consuming."""
+        return self.base_buffer.nbytes
+
     def merge(self, other: ReplayBuffer) -> None:
         """Merges another replay buffer into this replay buffer via the `push` method.
 
@@ -212,6 +234,8 @@ class ReplayBufferWrapper(ReplayBuffer):
         # can't merge when the other one has 0 items
         assert other.count > 0
 
+        num_items = len(other)
+
         # if no count, we need to manually push one item first to build the index
         if self.count == 0:
             self.push(other[0])
@@ -220,22 +244,40 @@ class ReplayBufferWrapper(ReplayBuffer):
                 return
 
             self.base_buffer.push(
-                [m[1 : len(other)] for m in other.base_buffer.memory],
+                [m[1:num_items] for m in other.base_buffer.memory],
                 bulk=True,
             )
         else:
             self.base_buffer.push(
-                [m[: len(other)] for m in other.base_buffer.memory],
+                [m[:num_items] for m in other.base_buffer.memory],
                 bulk=True,
             )
 
+    def iter_sample(
+        self, batch_size: int, num_iter: int
+    ) -> Generator[Sequence[Any]]:  # pyright: ignore[reportGeneralTypeIssues]
+        """Iterates over samples from the base buffer, so that any pipelining it does is kept.
+
+        Args:
+            batch_size (int): batch_size
+            num_iter (int): num_iter
+
+        Returns:
+            Generator[Sequence[Any], None, None]:
+
+        """
+        for batch in self.base_buffer.iter_sample(
+            batch_size=batch_size, num_iter=num_iter
+        ):
+            yield self.wrap_data(batch)
+
     def __len__(self) -> int:
         """The number of memory items this replay buffer is holding."""
         return len(self.base_buffer)
 
     def __repr__(self) -> str:
         """Printouts parameters of this replay buffer."""
-        return f"""ReplayBuffer of size {self.mem_size} with {len(self.memory)} elements. \n
+        return f"""ReplayBuffer of size {self.mem_size} with {len(self.base_buffer.memory)} elements. \n
         A brief view of the memory: \n
         {self.base_buffer}
         """
@@ -267,7 +309,7 @@ class ReplayBufferWrapper(ReplayBuffer):
             None:
 
         """
-        self.base_buffer.push(
+        self._base_push(
             data=self.unwrap_data(
                 wrapped_data=data,
                 bulk=bulk,
@@ -285,20 +327,20 @@ class ReplayBufferWrapper(ReplayBuffer):
             Sequence[Any]:
 
         """
-        return self.wrap_data(self.base_buffer.sample(batch_size=batch_size))
+        return self.wrap_data(self._base_sample(batch_size=batch_size))
 
     @abstractmethod
-    def unwrap_data(self, wrapped_data: Sequence[Any], bulk: bool) -> Sequence[Any]:
+    def unwrap_data(self, wrapped_data: Sequence[Any], bulk: bool) -> tuple[Any, ...]:
         """Unwraps data from the underlying data into an unwrapped format.
 
-        This is called when packing the data into the `base_buffer`.
+        This is called when packing the data into the `base_buffer`, which is handed the returned tuple as is.
 
         Args:
             wrapped_data (Sequence[Any]): wrapped_data
             bulk (bool): bulk
 
         Returns:
-            Sequence[Any]:
+            tuple[Any, ...]:
 
         """
         raise NotImplementedError
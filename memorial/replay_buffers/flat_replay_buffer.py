@@ -2,17 +2,22 @@
 
 from __future__ import annotations
 
+import contextlib
 import io
 import json
+import multiprocessing
+import queue
+import weakref
 import zipfile
-from collections.abc import Sequence
+from collections.abc import Generator, Sequence
 from enum import Enum
-from typing import Literal
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Literal
 
 import numpy as np
 
 from memorial.core import ReplayBuffer
-from memorial.utils import MemorialException
+from memorial.utils import MemorialException, prefetch_iter
 
 try:
     import torch
@@ -29,6 +34,74 @@ class _Mode(Enum):
     NUMPY = 2
 
 
+def _release_shared_memory(segments: list[SharedMemory]) -> None:
+    """Closes and frees shared memory segments.
+
+    Args:
+        segments (list[SharedMemory]): segments
+
+    Returns:
+        None:
+
+    """
+    for segment in segments:
+        # arrays still viewing the segment prevent closing it, but it can still be unlinked
+        with contextlib.suppress(BufferError):
+            segment.close()
+        segment.unlink()
+
+
+def _shared_array(
+    shape: tuple[int, ...], dtype: Any, segments: list[SharedMemory]
+) -> np.ndarray:
+    """Creates a numpy array backed by a new shared memory segment, which is appended to `segments`.
+
+    Args:
+        shape (tuple[int, ...]): shape
+        dtype (Any): dtype
+        segments (list[SharedMemory]): the list of segments to record the new segment in
+
+    Returns:
+        np.ndarray:
+
+    """
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    segment = SharedMemory(create=True, size=max(size, 1))
+    segments.append(segment)
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _parallel_sample_worker(
+    memory: list[np.ndarray],
+    outputs: list[np.ndarray],
+    tasks: Any,
+    results: Any,
+    seed: np.random.SeedSequence,
+) -> None:
+    """Gathers random batches from shared memory into shared output slots until told to stop.
+
+    Each task is a `(slot, num_items, batch_size)` tuple, and each result is a `(slot, num_sampled)` tuple.
+
+    Args:
+        memory (list[np.ndarray]): the shared memory of the replay buffer
+        outputs (list[np.ndarray]): one shared `(num_slots, batch_size, *shape)` array per field
+        tasks (Any): queue of tasks, `None` tells the worker to stop
+        results (Any): queue of results
+        seed (np.random.SeedSequence): seed
+
+    Returns:
+        None:
+
+    """
+    rng = np.random.default_rng(seed)
+    while (task := tasks.get()) is not None:
+        slot, num_items, batch_size = task
+        idx = rng.integers(0, num_items, size=min(num_items, batch_size))
+        for item, output in zip(memory, outputs):
+            np.take(item, idx, axis=0, out=output[slot, : len(idx)])
+        results.put((slot, len(idx)))
+
+
 class FlatReplayBuffer(ReplayBuffer):
     """Replay Buffer implementation of a Torch or Numpy dataset."""
 
@@ -39,6 +112,7 @@ class FlatReplayBuffer(ReplayBuffer):
         device: str | torch.device = torch.device("cpu"),
         store_on_device: bool = False,
         random_rollover: bool = False,
+        seed: int | None = None,
     ):
         """__init__.
 
@@ -48,6 +122,7 @@ class FlatReplayBuffer(ReplayBuffer):
             device (str | torch.device): The target device that data will be retrieved to if "torch".
             store_on_device (bool): Whether to store the entire replay on the specified device, otherwise stored on CPU.
             random_rollover (bool): whether to rollover the data in the replay buffer once full or to randomly insert
+            seed (int | None): seed for sampling and random rollover, drawn from the global numpy RNG if None
 
         """
         super().__init__(mem_size=mem_size)
@@ -68,6 +143,19 @@ class FlatReplayBuffer(ReplayBuffer):
         # random rollover
         self.random_rollover = random_rollover
 
+        # source of randomness for sampling and random rollover
+        # unseeded buffers draw their seed from the global RNG, so that `np.random.seed` still makes runs reproducible
+        if seed is None:
+            seed = int(np.random.randint(2**63, dtype=np.int64))
+        self._rng = np.random.default_rng(seed)
+
+        # shared memory segments backing the memory, if any, see `to_shared`
+        self._shared_segments: list[SharedMemory] = []
+        self._is_shared = False
+
+        # cached total of `memory.nbytes`, must be reset to None whenever `memory` is reallocated
+        self._nbytes_cache: int | None = None
+
         # store the mode
         if mode == "numpy":
             self.mode = _Mode.NUMPY
@@ -110,10 +198,9 @@ class FlatReplayBuffer(ReplayBuffer):
                 # splice out only the length required
                 array = array[: len(self)]
 
-                # save each array
-                with io.BytesIO() as array_buffer:
-                    np.save(array_buffer, array, allow_pickle=False)
-                    zipf.writestr(f"memory_{i}.npy", array_buffer.getvalue())
+                # save each array, streamed to avoid holding a second copy of it in memory
+                with zipf.open(f"memory_{i}.npy", "w", force_zip64=True) as array_file:
+                    np.save(array_file, array, allow_pickle=False)
 
     @staticmethod
     def load(fileobj: io.BytesIO | io.BufferedRandom) -> FlatReplayBuffer:
@@ -158,6 +245,19 @@ class FlatReplayBuffer(ReplayBuffer):
         """
         return list(d[idx] for d in self.memory)
 
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes that the core replay buffer is consuming.
+
+        This is cached, as the memory is only ever reallocated in `_allocate_fields`.
+
+        Returns:
+            int:
+        """
+        if self._nbytes_cache is None:
+            self._nbytes_cache = sum(d.nbytes for d in self.memory)
+        return self._nbytes_cache
+
     def _format_data(
         self, thing: np.ndarray | torch.Tensor | float | int | bool, bulk: bool
     ) -> np.ndarray | torch.Tensor:
@@ -208,6 +308,37 @@ class FlatReplayBuffer(ReplayBuffer):
 
         return data
 
+    def _allocate_fields(self, shapes: Sequence[tuple[int, ...]]) -> None:
+        """Allocates the memory as one contiguous `(mem_size, *shape)` array per field.
+
+        Args:
+            shapes (Sequence[tuple[int, ...]]): the shape of a single transition of each field
+
+        Returns:
+            None:
+
+        """
+        if self.mode == _Mode.TORCH:
+            self.memory = [
+                torch.zeros(
+                    (self.mem_size, *shape),
+                    dtype=self.mode_dtype,  # pyright: ignore[reportArgumentType, reportCallIssue]
+                    device=self.storage_device,
+                )
+                for shape in shapes
+            ]
+        else:
+            self.memory = [
+                np.zeros(
+                    (self.mem_size, *shape),
+                    dtype=self.mode_dtype,  # pyright: ignore[reportArgumentType, reportCallIssue]
+                )
+                for shape in shapes
+            ]
+
+        # the memory has been reallocated
+        self._nbytes_cache = None
+
     def push(
         self,
         data: Sequence[torch.Tensor | np.ndarray | float | int | bool],
@@ -253,31 +384,10 @@ class FlatReplayBuffer(ReplayBuffer):
 
         # instantiate the memory if it does not exist
         if self.count == 0:
-            self.memory = []
             if not bulk:
-                self.memory.extend(
-                    [
-                        self.mode_caller.zeros(
-                            (self.mem_size, *item.shape),
-                            dtype=self.mode_dtype,  # pyright: ignore[reportArgumentType, reportCallIssue, reportGeneralTypeIssues]
-                        )
-                        for item in array_data
-                    ]
-                )
+                self._allocate_fields([item.shape for item in array_data])
             else:
-                self.memory.extend(
-                    [
-                        self.mode_caller.zeros(
-                            (self.mem_size, *item.shape[1:]),
-                            dtype=self.mode_dtype,  # pyright: ignore[reportArgumentType, reportCallIssue, reportGeneralTypeIssues]
-                        )
-                        for item in array_data
-                    ]
-                )
-
-            # move everything to the storage device if torch
-            if self.mode == _Mode.TORCH:
-                self.memory = [array.to(self.storage_device) for array in self.memory]
+                self._allocate_fields([item.shape[1:] for item in array_data])
 
         # assert that the number of lists in memory is same as data to push
         if len(array_data) != len(self.memory):
@@ -293,26 +403,33 @@ class FlatReplayBuffer(ReplayBuffer):
         if self.random_rollover:
             if not self.is_full:
                 idx_front = np.arange(start, stop)
-                idx_back = np.random.choice(
+                idx_back = self._rng.choice(
                     start,
                     size=np.maximum(rollover, 0),
                     replace=False,
                 )
             else:
-                idx_front = np.random.choice(
+                idx_front = self._rng.choice(
                     self.mem_size,
                     size=bulk_size,
                     replace=False,
                 )
                 idx_back = np.array([], dtype=np.int64)
+            idx = np.concatenate((idx_front, idx_back), axis=0)
+
+            # put things in memory
+            for memory, item in zip(self.memory, array_data):
+                memory[idx] = item
+        elif rollover <= 0:
+            # positions are contiguous, so this is a plain slice write per field
+            for memory, item in zip(self.memory, array_data):
+                memory[start:stop] = item
         else:
-            idx_front = np.arange(start, stop)
-            idx_back = np.arange(0, rollover)
-        idx = np.concatenate((idx_front, idx_back), axis=0)
-
-        # put things in memory
-        for memory, item in zip(self.memory, array_data):
-            memory[idx] = item
+            # positions wrap around the end of the memory, only possible for bulk data
+            num_front = stop - start
+            for memory, item in zip(self.memory, array_data):
+                memory[start:stop] = item[:num_front]
+                memory[:rollover] = item[num_front:]
 
         self.count += bulk_size
 
@@ -326,12 +443,241 @@ class FlatReplayBuffer(ReplayBuffer):
             list[np.ndarray | torch.Tensor]:
 
         """
-        idx = np.random.randint(
-            0,
-            len(self),
-            size=np.minimum(len(self), batch_size),
-        )
+        idx = self._sample_idx(batch_size=batch_size)
         if self.mode == _Mode.TORCH:
+            # convert and move the index once instead of once per field
+            idx = torch.from_numpy(idx).to(self.storage_device)
             return [item[idx].to(self.device) for item in self.memory]
         else:
             return [item[idx] for item in self.memory]
+
+    def _sample_idx(self, batch_size: int) -> np.ndarray:
+        """Samples random indices of transitions held in memory.
+
+        Args:
+            batch_size (int): batch_size
+
+        Returns:
+            np.ndarray:
+
+        """
+        return self._rng.integers(0, len(self), size=min(len(self), batch_size))
+
+    def iter_sample(
+        self, batch_size: int, num_iter: int
+    ) -> Generator[list[np.ndarray | torch.Tensor], None, None]:
+        """iter_sample.
+
+        If the memory is stored on the CPU but sampled to a CUDA device,
+        batches are gathered into pinned host buffers and copied to the device on a separate stream,
+        so that the transfer of the next batch overlaps with whatever is being done with the current one.
+
+        Args:
+            batch_size (int): batch_size
+            num_iter (int): num_iter
+
+        Returns:
+            Generator[list[np.ndarray | torch.Tensor], None, None]:
+
+        """
+        if (
+            self.mode == _Mode.TORCH
+            and self.device.type == "cuda"
+            and self.storage_device.type == "cpu"
+        ):
+            return self._iter_sample_cuda(  # pyright: ignore[reportReturnType]
+                batch_size=batch_size, num_iter=num_iter
+            )
+        else:
+            return super().iter_sample(  # pyright: ignore[reportReturnType]
+                batch_size=batch_size, num_iter=num_iter
+            )
+
+    def _iter_sample_cuda(
+        self, batch_size: int, num_iter: int
+    ) -> Generator[list[torch.Tensor], None, None]:
+        """Samples batches from CPU memory onto a CUDA device using double-buffered pinned memory.
+
+        Args:
+            batch_size (int): batch_size
+            num_iter (int): num_iter
+
+        Returns:
+            Generator[list[torch.Tensor], None, None]:
+
+        """
+        copy_stream = torch.cuda.Stream(device=self.device)
+
+        # two sets of pinned host buffers, so one can be gathered into while the other is copied to the device
+        staging = [
+            [
+                torch.empty(
+                    (batch_size, *item.shape[1:]), dtype=item.dtype, pin_memory=True
+                )
+                for item in self.memory
+            ]
+            for _ in range(2)
+        ]
+        copy_events: list[torch.cuda.Event | None] = [None, None]
+
+        def _stage() -> (
+            Generator[tuple[list[torch.Tensor], torch.cuda.Event], None, None]
+        ):
+            for i in range(num_iter):
+                slot = i % 2
+
+                # the previous copy out of this set of buffers must be done before we overwrite it
+                if (event := copy_events[slot]) is not None:
+                    event.synchronize()
+
+                idx = torch.from_numpy(self._sample_idx(batch_size=batch_size))
+                host_batch = [
+                    torch.index_select(item, 0, idx, out=buffer[: len(idx)])
+                    for item, buffer in zip(self.memory, staging[slot])
+                ]
+
+                # issue the copies on the side stream and mark when they are done
+                with torch.cuda.stream(copy_stream):
+                    device_batch = [
+                        item.to(self.device, non_blocking=True) for item in host_batch
+                    ]
+                    event = torch.cuda.Event()
+                    event.record(copy_stream)
+                copy_events[slot] = event
+
+                yield device_batch, event
+
+        for device_batch, event in prefetch_iter(_stage()):
+            # make the consumer's stream wait on the copy, and let the allocator know the tensors are used there
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            for item in device_batch:
+                item.record_stream(current_stream)
+
+            yield device_batch
+
+    def to_shared(self) -> None:
+        """Moves the memory into shared memory, so that forked worker processes can read it without copying.
+
+        The buffer must already hold data, and everything pushed afterwards is written into the shared memory in place.
+
+        Returns:
+            None:
+
+        """
+        if self._is_shared:
+            return
+        if self.count == 0:
+            raise MemorialException(
+                "The replay buffer must hold data before it can be moved to shared memory."
+            )
+        if self.storage_device.type != "cpu":
+            raise MemorialException(
+                f"Only memory stored on the CPU can be shared, but memory is stored on {self.storage_device}."
+            )
+
+        if self.mode == _Mode.TORCH:
+            for item in self.memory:
+                item.share_memory_()
+        else:
+            shared_memory = []
+            for item in self.memory:
+                array = _shared_array(item.shape, item.dtype, self._shared_segments)
+                array[...] = item
+                shared_memory.append(array)
+            self.memory = shared_memory
+            weakref.finalize(self, _release_shared_memory, self._shared_segments)
+
+        self._is_shared = True
+
+    def parallel_iter_sample(
+        self, batch_size: int, num_iter: int, num_workers: int = 2
+    ) -> Generator[list[np.ndarray | torch.Tensor], None, None]:
+        """Iterates over samples that are gathered in parallel by forked worker processes.
+
+        The memory must first be moved to shared memory using `to_shared`.
+        Workers gather batches into shared output slots, so only slot numbers are sent between processes.
+        This relies on the `fork` start method, and so is unavailable on Windows.
+
+        Args:
+            batch_size (int): batch_size
+            num_iter (int): num_iter
+            num_workers (int): number of worker processes
+
+        Returns:
+            Generator[list[np.ndarray | torch.Tensor], None, None]:
+
+        """
+        if not self._is_shared:
+            raise MemorialException(
+                "The memory must be moved to shared memory with `to_shared` before sampling in parallel."
+            )
+
+        context = multiprocessing.get_context("fork")
+        tasks = context.SimpleQueue()
+        results = context.Queue()
+
+        # numpy views of the memory, tensors in shared memory stay shared through these
+        memory = [
+            item.numpy() if isinstance(item, torch.Tensor) else item
+            for item in self.memory
+        ]
+
+        # two output slots per worker, so workers can fill one while the other is being read
+        num_slots = 2 * num_workers
+        output_segments: list[SharedMemory] = []
+        outputs = [
+            _shared_array(
+                (num_slots, batch_size, *item.shape[1:]), item.dtype, output_segments
+            )
+            for item in memory
+        ]
+
+        seeds = np.random.SeedSequence(self._rng.integers(2**63)).spawn(num_workers)
+        workers = [
+            context.Process(
+                target=_parallel_sample_worker,
+                args=(memory, outputs, tasks, results, seed),
+                daemon=True,
+            )
+            for seed in seeds
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            # fill up all the slots, `len(self)` is sent along as it changes with pushes
+            num_submitted = min(num_slots, num_iter)
+            for slot in range(num_submitted):
+                tasks.put((slot, len(self), batch_size))
+
+            for _ in range(num_iter):
+                while True:
+                    try:
+                        slot, num_sampled = results.get(timeout=1.0)
+                        break
+                    except queue.Empty:
+                        if not all(worker.is_alive() for worker in workers):
+                            raise MemorialException(
+                                "A sampling worker exited unexpectedly."
+                            )
+
+                # copy the batch out so that the slot can be refilled
+                batch = [output[slot, :num_sampled].copy() for output in outputs]
+                if num_submitted < num_iter:
+                    tasks.put((slot, len(self), batch_size))
+                    num_submitted += 1
+
+                if self.mode == _Mode.TORCH:
+                    yield [torch.from_numpy(item).to(self.device) for item in batch]
+                else:
+                    yield batch  # pyright: ignore[reportReturnType]
+        finally:
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join(timeout=1.0)
+                if worker.is_alive():
+                    worker.terminate()
+            del outputs
+            _release_shared_memory(output_segments)
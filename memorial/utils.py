@@ -1,8 +1,17 @@
-"""For fancy printing."""
+"""For fancy printing, prefetching, and exceptions."""
 
 from __future__ import annotations
 
-from typing import Any, Literal
+import threading
+import weakref
+from collections.abc import Generator, Iterable
+from queue import Full, Queue
+from typing import Any, Literal, TypeVar
+
+_T = TypeVar("_T")
+
+# marks the end of a prefetched iterable
+_SENTINEL = object()
 
 # colour list
 c_colors = {
@@ -37,6 +46,63 @@ def cstr(
     return f"{c_colors[ctype]}{x}{end_c}"
 
 
+def prefetch_iter(iterable: Iterable[_T]) -> Generator[_T, None, None]:
+    """Iterates over an iterable in a background thread, keeping one item ready ahead of the consumer.
+
+    The background thread starts immediately, so the first item is already being prepared before the first `next`.
+    Exceptions raised while iterating in the background are re-raised to the consumer.
+
+    Args:
+        iterable (Iterable[_T]): the iterable to iterate over in the background
+
+    Returns:
+        Generator[_T, None, None]:
+
+    """
+    queue: Queue[Any] = Queue(maxsize=1)
+    stop = threading.Event()
+    errors: list[BaseException] = []
+
+    def _put(item: Any) -> bool:
+        # blocks until the item is queued, or gives up once the consumer has stopped
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in iterable:
+                if not _put(item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(_SENTINEL)
+
+    def _consume() -> Generator[_T, None, None]:
+        try:
+            yield from iter(queue.get, _SENTINEL)
+        finally:
+            # if the consumer stops early, let the producer exit
+            stop.set()
+
+        if errors:
+            raise errors[0]
+
+    threading.Thread(target=_produce, daemon=True).start()
+
+    consumer = _consume()
+
+    # a consumer that is never started does not run its `finally`, so also stop the producer when it is collected
+    weakref.finalize(consumer, stop.set)
+
+    return consumer
+
+
 class MemorialException(Exception):
     """ReplayBufferException."""
 
@@ -2,10 +2,12 @@
 
 from __future__ import annotations
 
+import functools
 import io
 import json
+import shutil
 import zipfile
-from collections.abc import Mapping, Sequence
+from collections.abc import Callable, Mapping, Sequence
 from typing import Any, Union
 
 import numpy as np
@@ -24,9 +26,36 @@ except ImportError as e:
 _NestedDict = Mapping[str, Union[int, "_NestedDict"]]
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_function(source: str, name: str) -> Callable[..., Any]:
+    """Compiles `source` and returns the function called `name` defined in it.
+
+    The result is cached, so buffers sharing the same data layout also share the compiled code.
+
+    Args:
+        source (str): source
+        name (str): name
+
+    Returns:
+        Callable[..., Any]:
+
+    """
+    namespace: dict[str, Any] = dict()
+    exec(compile(source, f"<memorial-{name}>", "exec"), namespace)
+    return namespace[name]
+
+
 class DictReplayBufferWrapper(ReplayBufferWrapper):
     """Replay Buffer Wrapper that allows the underlying replay buffer to take in nested dicts."""
 
+    __slots__ = (
+        "mapping",
+        "total_elements",
+        "_unwrap_fn",
+        "_wrap_fn",
+        "_dict_slots",
+    )
+
     def __init__(
         self, replay_buffer: FlatReplayBuffer, from_populated: bool = False
     ) -> None:
@@ -57,6 +86,14 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
         self.mapping: list[int | _NestedDict] = []
         self.total_elements = 0
 
+        # functions compiled from `self.mapping` once it is known, so that (un)wrapping is straight-line code:
+        # - `_unwrap_fn(wrapped_data)` gathers the wrapped data into a tuple of unwrapped data
+        # - `_wrap_fn(unwrapped_data)` gathers the unwrapped data into a new list of wrapped data
+        # - `_dict_slots` holds `(wrapped_idx, mapping)` for each dict item in the wrapped data
+        self._unwrap_fn: Callable[[Sequence[Any]], tuple[Any, ...]] = lambda w: ()
+        self._wrap_fn: Callable[[Sequence[Any]], list[Any]] = lambda u: []
+        self._dict_slots: list[tuple[int, _NestedDict]] = []
+
     def dump(self, fileobj: io.BytesIO | io.BufferedRandom) -> None:
         """Dump the replay buffer to a fileobj.
 
@@ -74,8 +111,8 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
         self.base_buffer.dump(base_buffer_io)
         base_buffer_io.seek(0)
 
-        # save everything
-        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zipf:
+        # save everything, the base buffer is already compressed so it is stored as is
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as zipf:
             # save the running params
             dict_bytes = json.dumps(
                 {
@@ -83,10 +120,15 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
                     "total_elements": self.total_elements,
                 }
             ).encode("utf-8")
-            zipf.writestr("running_params.json", dict_bytes)
+            zipf.writestr(
+                "running_params.json", dict_bytes, compress_type=zipfile.ZIP_DEFLATED
+            )
 
-            # save the base buffer
-            zipf.writestr("base_buffer.zip", base_buffer_io.getvalue())
+            # save the base buffer, streamed to avoid holding a second copy of it in memory
+            with zipf.open(
+                "base_buffer.zip", "w", force_zip64=True
+            ) as base_buffer_file:
+                shutil.copyfileobj(base_buffer_io, base_buffer_file, length=1 << 20)
 
     @staticmethod
     def load(fileobj: io.BytesIO | io.BufferedRandom) -> DictReplayBufferWrapper:
@@ -106,16 +148,20 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
             dict_bytes = zipf.read("running_params.json")
             running_params = json.loads(dict_bytes.decode("utf-8"))
 
-            # load the base_buffer
-            base_buffer_io = io.BytesIO(zipf.read("base_buffer.zip"))
-            base_buffer = FlatReplayBuffer.load(base_buffer_io)
+            # load the base_buffer, streamed to avoid holding a second copy of it in memory
+            with zipf.open("base_buffer.zip") as base_buffer_file:
+                base_buffer = FlatReplayBuffer.load(
+                    base_buffer_file  # pyright: ignore[reportArgumentType]
+                )
 
         # reconstruct the buffer
         replay_buffer = DictReplayBufferWrapper(
             replay_buffer=base_buffer, from_populated=True
         )
-        replay_buffer.mapping = running_params["mapping"]
-        replay_buffer.total_elements = running_params["total_elements"]
+        replay_buffer._set_mapping(
+            mapping=running_params["mapping"],
+            total_elements=running_params["total_elements"],
+        )
         return replay_buffer
 
     @staticmethod
@@ -224,127 +270,277 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
         return mapping, idx
 
     @staticmethod
-    def _recursive_unpack_dict_data(
-        data_dict: dict[str, np.ndarray | torch.Tensor],
-        unwrapped_data_target: list[Any],
+    def _recursive_emit_unpack_lines(
         mapping: _NestedDict,
-    ) -> list[Any]:
-        """Recursively unpacks dictionary data into a sequence of items that FlatReplayBuffer can use.
+        dict_var: str,
+        lines: list[str],
+        leaf_exprs: dict[int, str],
+        keys: list[Any],
+    ) -> None:
+        """Recursively emits source that reaches the leaves of the dict in `dict_var`.
+
+        Nested dicts are bound to variables in `lines`,
+        and the expression for each leaf is recorded against its flat index in `leaf_exprs`.
+        Keys are never written into the source, each is appended to `keys` and referred to as `k{i}`.
 
         Args:
-            data_dict (dict[str, np.ndarray | torch.Tensor]): data_dict
-            unwrapped_data_target (list[Any]): unwrapped_data_target
             mapping (_NestedDict): mapping
+            dict_var (str): name of the variable holding the dict that `mapping` describes
+            lines (list[str]): the list of lines to append to
+            leaf_exprs (dict[int, str]): the expression for each flat index
+            keys (list[Any]): the keys referred to by the source
 
         Returns:
-            list[Any]:
+            None:
 
         """
-        for key, value in data_dict.items():
-            if isinstance((idx_map := mapping[key]), int):
-                unwrapped_data_target[idx_map] = value
-
-            elif isinstance((idx_map := mapping[key]), dict):
-                if not isinstance(value, dict):
-                    raise MemorialException(
-                        "Something went wrong with data unwrapping.\n"
-                        f"Expected a dictionary for key {key} within the data, but got {type(value)}."
-                    )
+        for key, idx_map in mapping.items():
+            key_var = f"k{len(keys)}"
+            keys.append(key)
+            if type(idx_map) is int:
+                leaf_exprs[idx_map] = f"{dict_var}[{key_var}]"
+            elif type(idx_map) is dict:
+                sub_dict_var = f"d{len(lines)}"
+                lines.append(f"        {sub_dict_var} = {dict_var}[{key_var}]")
+                DictReplayBufferWrapper._recursive_emit_unpack_lines(
+                    mapping=idx_map,
+                    dict_var=sub_dict_var,
+                    lines=lines,
+                    leaf_exprs=leaf_exprs,
+                    keys=keys,
+                )
+            else:
+                raise ValueError("Not supposed to be here")
 
-                unwrapped_data_target = (
-                    DictReplayBufferWrapper._recursive_unpack_dict_data(
-                        data_dict=value,
-                        unwrapped_data_target=unwrapped_data_target,
-                        mapping=idx_map,
-                    )
+    @staticmethod
+    def _recursive_emit_pack_expr(mapping: _NestedDict, keys: list[Any]) -> str:
+        """Recursively emits a dict display expression that gathers the leaves of `mapping` from `u`.
+
+        Keys are never written into the source, each is appended to `keys` and referred to as `k{i}`.
+
+        Args:
+            mapping (_NestedDict): mapping
+            keys (list[Any]): the keys referred to by the source
+
+        Returns:
+            str:
+
+        """
+        items: list[str] = []
+        for key, idx_map in mapping.items():
+            key_var = f"k{len(keys)}"
+            keys.append(key)
+            if type(idx_map) is int:
+                items.append(f"{key_var}: u[{idx_map}]")
+            elif type(idx_map) is dict:
+                items.append(
+                    f"{key_var}: {DictReplayBufferWrapper._recursive_emit_pack_expr(idx_map, keys)}"
                 )
             else:
                 raise ValueError("Not supposed to be here")
 
-        return unwrapped_data_target
+        return "{" + ", ".join(items) + "}"
 
-    def unwrap_data(
-        self,
-        wrapped_data: Sequence[
-            dict[str, Any] | np.ndarray | torch.Tensor | float | int | bool
-        ],
-        bulk: bool,
-    ) -> Sequence[np.ndarray | torch.Tensor | float | int | bool]:
-        """Unwraps dictionary data into a sequence of items that FlatReplayBuffer can use.
+    @staticmethod
+    def _compile_unwrap(
+        mapping: list[int | _NestedDict],
+    ) -> Callable[[Sequence[Any]], tuple[Any, ...]]:
+        """Compiles a function that gathers wrapped data following `mapping` into a flat tuple.
 
-        If bulk adding items, this expects dictionary items to be a dictionary of lists, NOT a list of dictionaries.
+        For example, the mapping `[0, {"a": 1, "b": {"c": 2}}]` compiles into the factory below,
+        which is then called with the keys `("a", "b", "c")`:
+
+            def _make_unwrap(k0, k1, k2, ):
+                def _unwrap(w):
+                    d1 = w[1]
+                    d2 = d1[k1]
+                    return (w[0], d1[k0], d2[k2], )
+                return _unwrap
 
         Args:
-            wrapped_data (Sequence[dict[str, Any] | np.ndarray | torch.Tensor | float | int | bool]): wrapped_data
-            bulk (bool): bulk
+            mapping (list[int | _NestedDict]): mapping
 
         Returns:
-            Sequence[np.ndarray | torch.Tensor | float | int | bool]:
+            Callable[[Sequence[Any]], tuple[Any, ...]]:
 
         """
-        if not self.mapping:
-            self.mapping, self.total_elements = self._generate_mapping(
-                wrapped_data=wrapped_data
-            )
+        lines = ["    def _unwrap(w):"]
+        leaf_exprs: dict[int, str] = dict()
+        keys: list[Any] = []
+        for wrapped_idx, idx_map in enumerate(mapping):
+            if type(idx_map) is int:
+                leaf_exprs[idx_map] = f"w[{wrapped_idx}]"
+            elif type(idx_map) is dict:
+                dict_var = f"d{len(lines)}"
+                lines.append(f"        {dict_var} = w[{wrapped_idx}]")
+                DictReplayBufferWrapper._recursive_emit_unpack_lines(
+                    mapping=idx_map,
+                    dict_var=dict_var,
+                    lines=lines,
+                    leaf_exprs=leaf_exprs,
+                    keys=keys,
+                )
+            else:
+                raise ValueError("Not supposed to be here")
 
-        if len(self.mapping) != len(wrapped_data):
-            raise MemorialException(
-                "Something went wrong with data unwrapping.\n"
-                f"Expected `wrapped_data` to have {len(self.mapping)} items, but got {len(wrapped_data)}."
-            )
+        # build the whole flat tuple in one go, in order of flat index
+        lines.append(
+            f"        return ({''.join(f'{e}, ' for _, e in sorted(leaf_exprs.items()))})"
+        )
 
-        # holder for the unwrapped data
-        unwrapped_data: list[Any] = [None] * self.total_elements
+        # the keys are bound as arguments of the factory, so that the source only depends on the layout
+        source = "\n".join(
+            [
+                f"def _make_unwrap({''.join(f'k{i}, ' for i in range(len(keys)))}):",
+                *lines,
+                "    return _unwrap",
+            ]
+        )
+        return _compile_function(source, "_make_unwrap")(*keys)
 
-        for i, (mapping, data_item) in enumerate(zip(self.mapping, wrapped_data)):
-            # if the mapping says it's an int, then just set the data without nesting
-            if isinstance(mapping, int):
-                unwrapped_data[mapping] = data_item
+    @staticmethod
+    def _compile_wrap(
+        mapping: list[int | _NestedDict],
+    ) -> Callable[[Sequence[Any]], list[Any]]:
+        """Compiles a function that gathers items from a flat sequence into wrapped data following `mapping`.
 
-            # if it's a dict, then we need to recursively unpack
-            elif isinstance(mapping, dict):
-                if not isinstance(data_item, dict):
-                    raise MemorialException(
-                        "Something went wrong with data unwrapping.\n"
-                        f"Expected `wrapped_data` at element {i} to be a dict, but got {type(data_item)}."
-                    )
+        For example, the mapping `[0, {"a": 1, "b": {"c": 2}}]` compiles into the factory below,
+        which is then called with the keys `("a", "b", "c")`:
+
+            def _make_wrap(k0, k1, k2, ):
+                def _wrap(u):
+                    return [u[0], {k0: u[1], k1: {k2: u[2]}}]
+                return _wrap
 
-                unwrapped_data = self._recursive_unpack_dict_data(
-                    data_dict=data_item,
-                    unwrapped_data_target=unwrapped_data,
-                    mapping=mapping,
+        Args:
+            mapping (list[int | _NestedDict]): mapping
+
+        Returns:
+            Callable[[Sequence[Any]], list[Any]]:
+
+        """
+        items: list[str] = []
+        keys: list[Any] = []
+        for idx_map in mapping:
+            if type(idx_map) is int:
+                items.append(f"u[{idx_map}]")
+            elif type(idx_map) is dict:
+                items.append(
+                    DictReplayBufferWrapper._recursive_emit_pack_expr(idx_map, keys)
                 )
+            else:
+                raise ValueError("Not supposed to be here")
+
+        # the keys are bound as arguments of the factory, so that the source only depends on the layout
+        source = "\n".join(
+            [
+                f"def _make_wrap({''.join(f'k{i}, ' for i in range(len(keys)))}):",
+                "    def _wrap(u):",
+                f"        return [{', '.join(items)}]",
+                "    return _wrap",
+            ]
+        )
+        return _compile_function(source, "_make_wrap")(*keys)
+
+    def _set_mapping(
+        self, mapping: list[int | _NestedDict], total_elements: int
+    ) -> None:
+        """Sets the mapping of this buffer and precompiles the functions used for (un)wrapping.
+
+        Args:
+            mapping (list[int | _NestedDict]): mapping
+            total_elements (int): total_elements
 
-        return unwrapped_data
+        Returns:
+            None:
+
+        """
+        self.mapping = mapping
+        self.total_elements = total_elements
+
+        self._unwrap_fn = self._compile_unwrap(mapping)
+        self._wrap_fn = self._compile_wrap(mapping)
+        self._dict_slots = [
+            (i, idx_map) for i, idx_map in enumerate(mapping) if type(idx_map) is dict
+        ]
 
     @staticmethod
-    def _recursive_pack_dict_data(
-        unwrapped_data: Sequence[Any],
+    def _recursive_validate_dict_data(
+        data_dict: Any,
         mapping: _NestedDict,
-    ) -> dict[str, Any]:
-        """Packs back a sequence of items into a dictionary structure according to a mapping.
+        location: str,
+    ) -> None:
+        """Recursively checks that `data_dict` is a dict with the same structure as `mapping`.
 
         Args:
-            unwrapped_data (Sequence[Any]): unwrapped_data
+            data_dict (Any): data_dict
             mapping (_NestedDict): mapping
+            location (str): description of where `data_dict` sits in the wrapped data, for error messages
 
         Returns:
-            dict[str, Any]:
+            None:
 
         """
-        data_dict = dict()
+        if not isinstance(data_dict, dict):
+            raise MemorialException(
+                "Something went wrong with data unwrapping.\n"
+                f"Expected {location} to be a dict, but got {type(data_dict)}."
+            )
+
+        if data_dict.keys() != mapping.keys():
+            raise MemorialException(
+                "Something went wrong with data unwrapping.\n"
+                f"Expected {location} to have keys {list(mapping.keys())}, but got {list(data_dict.keys())}."
+            )
+
         for key, idx_map in mapping.items():
-            if isinstance(idx_map, int):
-                data_dict[key] = unwrapped_data[idx_map]
-            elif isinstance(idx_map, dict):
-                data_dict[key] = DictReplayBufferWrapper._recursive_pack_dict_data(
-                    unwrapped_data=unwrapped_data,
+            if type(idx_map) is dict:
+                DictReplayBufferWrapper._recursive_validate_dict_data(
+                    data_dict=data_dict[key],
                     mapping=idx_map,
+                    location=f"{location} under key {key!r}",
                 )
-            else:
-                raise ValueError("Not supposed to be here")
 
-        return data_dict
+    def unwrap_data(
+        self,
+        wrapped_data: Sequence[
+            dict[str, Any] | np.ndarray | torch.Tensor | float | int | bool
+        ],
+        bulk: bool,
+    ) -> tuple[np.ndarray | torch.Tensor | float | int | bool, ...]:
+        """Unwraps dictionary data into a tuple of items that FlatReplayBuffer can use.
+
+        If bulk adding items, this expects dictionary items to be a dictionary of lists, NOT a list of dictionaries.
+
+        The structure of `wrapped_data` is only validated against the mapping when not running with `python -O`.
+
+        Args:
+            wrapped_data (Sequence[dict[str, Any] | np.ndarray | torch.Tensor | float | int | bool]): wrapped_data
+            bulk (bool): bulk
+
+        Returns:
+            tuple[np.ndarray | torch.Tensor | float | int | bool, ...]:
+
+        """
+        if not self.mapping:
+            self._set_mapping(*self._generate_mapping(wrapped_data=wrapped_data))
+
+        # sanity checks on the structure of the data, these are stripped when running with `python -O`
+        if __debug__:
+            if len(self.mapping) != len(wrapped_data):
+                raise MemorialException(
+                    "Something went wrong with data unwrapping.\n"
+                    f"Expected `wrapped_data` to have {len(self.mapping)} items, but got {len(wrapped_data)}."
+                )
+
+            for i, idx_map in self._dict_slots:
+                self._recursive_validate_dict_data(
+                    data_dict=wrapped_data[i],
+                    mapping=idx_map,
+                    location=f"`wrapped_data` at element {i}",
+                )
+
+        return self._unwrap_fn(wrapped_data)
 
     def wrap_data(
         self, unwrapped_data: Sequence[np.ndarray | torch.Tensor | float | int | bool]
@@ -366,17 +562,4 @@ class DictReplayBufferWrapper(ReplayBufferWrapper):
             Sequence[dict[str, np.ndarray | torch.Tensor] | np.ndarray | torch.Tensor | float | int | bool]:
 
         """
-        wrapped_data: list[Any] = [None] * len(self.mapping)
-
-        for i, idx_map in enumerate(self.mapping):
-            if isinstance(idx_map, int):
-                wrapped_data[i] = unwrapped_data[idx_map]
-            elif isinstance(idx_map, dict):
-                wrapped_data[i] = DictReplayBufferWrapper._recursive_pack_dict_data(
-                    unwrapped_data=unwrapped_data,
-                    mapping=idx_map,
-                )
-            else:
-                raise ValueError("Not supposed to be here")
-
-        return wrapped_data
+        return self._wrap_fn(unwrapped_data)
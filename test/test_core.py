@@ -3,12 +3,15 @@
 from __future__ import annotations
 
 import io
+import sys
 import tempfile
 from copy import deepcopy
+from enum import Enum
 from itertools import product
 from pprint import pformat
 from typing import Literal
 
+import numpy as np
 import pytest
 import torch
 from utils import (
@@ -16,10 +19,15 @@ from utils import (
     create_memory,
     create_shapes,
     element_to_bulk_dim_swap,
+    flatten_shapes,
     generate_random_dict_data,
     generate_random_flat_data,
 )
 
+from memorial.replay_buffers import FlatReplayBuffer
+from memorial.utils import MemorialException
+from memorial.wrappers import DictReplayBufferWrapper
+
 # define the test configurations
 _random_rollovers = [True, False]
 _modes = ["numpy", "torch"]
@@ -180,6 +188,289 @@ def test_bulk(
                 step {step}, expected \n{pformat(item1)}, got \n{pformat(item2)}."""
 
 
+@pytest.mark.parametrize(
+    "random_rollover, mode, device, store_on_device, use_dict",
+    ALL_CONFIGURATIONS,
+)
+def test_iter_sample(
+    random_rollover: bool,
+    mode: Literal["numpy", "torch"],
+    device: torch.device,
+    store_on_device: bool,
+    use_dict: bool,
+):
+    """Tests that iterating over samples yields batches drawn from the buffer."""
+    mem_size = 11
+    batch_size = 5
+    num_iter = 4
+    shapes = create_shapes(use_dict=use_dict)
+    memory = create_memory(
+        mem_size=mem_size,
+        mode=mode,
+        device=device,
+        store_on_device=store_on_device,
+        random_rollover=random_rollover,
+        use_dict=use_dict,
+    )
+
+    # fill up the memory
+    for _ in range(mem_size):
+        data = []
+        for shape in shapes:
+            if isinstance(shape, (list, tuple)):
+                data.append(generate_random_flat_data(shape=shape, mode=mode))
+            elif isinstance(shape, dict):
+                data.append(generate_random_dict_data(shapes=shape, mode=mode))
+            else:
+                raise ValueError
+        memory.push(data)
+    stored_data = [memory[i] for i in range(mem_size)]
+
+    num_batches = 0
+    for batch in memory.iter_sample(batch_size=batch_size, num_iter=num_iter):
+        num_batches += 1
+
+        # every sampled transition must be somewhere in the memory
+        for sample in element_to_bulk_dim_swap(
+            element_first_data=list(batch),
+            bulk_size=batch_size,
+        ):
+            assert any(
+                are_equivalent(sample, item) for item in stored_data
+            ), f"""Sampled \n{pformat(sample)}, which is not in the memory."""
+
+    assert (
+        num_batches == num_iter
+    ), f"""Expected {num_iter} batches, got {num_batches}."""
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a CUDA device")
+def test_iter_sample_cuda():
+    """Tests that iterating over CPU memory onto a CUDA device yields batches on the device."""
+    mem_size = 11
+    batch_size = 5
+    num_iter = 4
+    device = torch.device("cuda:0")
+    shapes = [s for s in create_shapes(use_dict=False) if isinstance(s, tuple)]
+    memory = FlatReplayBuffer(
+        mem_size=mem_size, mode="torch", device=device, store_on_device=False
+    )
+
+    # fill up the memory
+    for _ in range(mem_size):
+        memory.push([generate_random_flat_data(shape=s, mode="torch") for s in shapes])
+    stored_data = [memory[i] for i in range(mem_size)]
+
+    num_batches = 0
+    for batch in memory.iter_sample(batch_size=batch_size, num_iter=num_iter):
+        num_batches += 1
+
+        for item in batch:
+            assert isinstance(
+                item, torch.Tensor
+            ), f"Expected a torch.Tensor, got {type(item)}."
+            assert (
+                item.device == device
+            ), f"Expected the batch on {device}, got {item.device}."
+
+        # every sampled transition must be somewhere in the memory
+        for sample in element_to_bulk_dim_swap(
+            element_first_data=list(batch),
+            bulk_size=batch_size,
+        ):
+            assert any(
+                are_equivalent(sample, item) for item in stored_data
+            ), f"""Sampled \n{pformat(sample)}, which is not in the memory."""
+
+    assert (
+        num_batches == num_iter
+    ), f"""Expected {num_iter} batches, got {num_batches}."""
+
+
+@pytest.mark.parametrize(
+    "random_rollover, mode, use_dict, seed",
+    list(product(_random_rollovers, _modes, _use_dict, [42, None])),
+)
+def test_seeded_sampling(
+    random_rollover: bool,
+    mode: Literal["numpy", "torch"],
+    use_dict: bool,
+    seed: int | None,
+):
+    """Tests that two buffers with the same seed, or the same global seed if unseeded, hold and sample identical data."""
+    mem_size = 7
+    batch_size = 5
+    shapes = create_shapes(use_dict=use_dict)
+    memories = []
+    for _ in range(2):
+        np.random.seed(0)
+        memories.append(
+            create_memory(
+                mem_size=mem_size,
+                mode=mode,
+                device=torch.device("cpu"),
+                store_on_device=False,
+                random_rollover=random_rollover,
+                use_dict=use_dict,
+                seed=seed,
+            )
+        )
+
+    # push the same data into both, overflowing so that random rollover kicks in
+    for _ in range(2 * mem_size):
+        data = []
+        for shape in shapes:
+            if isinstance(shape, (list, tuple)):
+                data.append(generate_random_flat_data(shape=shape, mode=mode))
+            elif isinstance(shape, dict):
+                data.append(generate_random_dict_data(shapes=shape, mode=mode))
+            else:
+                raise ValueError
+        for memory in memories:
+            memory.push(data)
+
+    for i in range(mem_size):
+        assert are_equivalent(
+            memories[0][i], memories[1][i]
+        ), f"""Expected element {i} to be identical,
+            got \n{pformat(memories[0][i])} and \n{pformat(memories[1][i])}."""
+
+    for _ in range(3):
+        sample_1 = memories[0].sample(batch_size)
+        sample_2 = memories[1].sample(batch_size)
+        assert are_equivalent(
+            sample_1, sample_2
+        ), f"""Expected identical samples, got \n{pformat(sample_1)} and \n{pformat(sample_2)}."""
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires the fork start method")
+@pytest.mark.parametrize("mode", _modes)
+def test_parallel_iter_sample(mode: Literal["numpy", "torch"]):
+    """Tests that sampling in parallel from shared memory yields batches drawn from the buffer."""
+    mem_size = 11
+    batch_size = 5
+    num_iter = 7
+    shapes = [s for s in create_shapes(use_dict=False) if isinstance(s, tuple)]
+    memory = FlatReplayBuffer(mem_size=mem_size, mode=mode)
+
+    # fill up the memory, moving it to shared memory halfway
+    for i in range(mem_size):
+        if i == mem_size // 2:
+            memory.to_shared()
+        memory.push([generate_random_flat_data(shape=s, mode=mode) for s in shapes])
+    stored_data = [memory[i] for i in range(mem_size)]
+
+    num_batches = 0
+    for batch in memory.parallel_iter_sample(
+        batch_size=batch_size, num_iter=num_iter, num_workers=2
+    ):
+        num_batches += 1
+
+        # every sampled transition must be somewhere in the memory
+        for sample in element_to_bulk_dim_swap(
+            element_first_data=batch,
+            bulk_size=batch_size,
+        ):
+            assert any(
+                are_equivalent(sample, item) for item in stored_data
+            ), f"""Sampled \n{pformat(sample)}, which is not in the memory."""
+
+    assert (
+        num_batches == num_iter
+    ), f"""Expected {num_iter} batches, got {num_batches}."""
+
+
+@pytest.mark.parametrize(
+    "random_rollover, mode, device, store_on_device, use_dict",
+    ALL_CONFIGURATIONS,
+)
+def test_nbytes(
+    random_rollover: bool,
+    mode: Literal["numpy", "torch"],
+    device: torch.device,
+    store_on_device: bool,
+    use_dict: bool,
+):
+    """Tests that the reported number of bytes follows the allocated memory."""
+    mem_size = 13
+    shapes = create_shapes(use_dict=use_dict)
+    memory = create_memory(
+        mem_size=mem_size,
+        mode=mode,
+        device=device,
+        store_on_device=store_on_device,
+        random_rollover=random_rollover,
+        use_dict=use_dict,
+    )
+    assert memory.nbytes == 0, f"Expected 0 bytes, got {memory.nbytes}."
+
+    data = []
+    for shape in shapes:
+        if isinstance(shape, (list, tuple)):
+            data.append(generate_random_flat_data(shape=shape, mode=mode))
+        elif isinstance(shape, dict):
+            data.append(generate_random_dict_data(shapes=shape, mode=mode))
+        else:
+            raise ValueError
+    memory.push(data)
+
+    # each float32 element takes 4 bytes, and scalars are stored with a trailing dim of 1
+    expected_nbytes = 4 * mem_size * sum(np.prod(s) for s in flatten_shapes(shapes))
+    assert (
+        memory.nbytes == expected_nbytes
+    ), f"Expected {expected_nbytes} bytes, got {memory.nbytes}."
+
+
+class _Key(Enum):
+    """Non-str dict key for testing."""
+
+    A = "a"
+    B = "b"
+
+
+@pytest.mark.parametrize("mode", _modes)
+def test_non_str_keys(mode: Literal["numpy", "torch"]):
+    """Tests that dict keys are kept as is, even when they have no literal repr."""
+    memory = DictReplayBufferWrapper(FlatReplayBuffer(mem_size=5, mode=mode))
+
+    data = [
+        generate_random_flat_data(shape=(3,), mode=mode),
+        {
+            _Key.A: generate_random_flat_data(shape=(2,), mode=mode),
+            _Key.B: {float("inf"): generate_random_flat_data(shape=(), mode=mode)},
+            1: generate_random_flat_data(shape=(4,), mode=mode),
+        },
+    ]
+    memory.push(data)
+
+    assert are_equivalent(
+        memory[0], data
+    ), f"Expected {pformat(data)}, got {pformat(memory[0])}."
+    sample = memory.sample(1)
+    assert (
+        sample[1].keys() == data[1].keys()
+    ), f"Expected keys {data[1].keys()}, got {sample[1].keys()}."
+
+
+@pytest.mark.skipif(not __debug__, reason="validation is stripped with `python -O`")
+@pytest.mark.parametrize(
+    "bad_dict",
+    [
+        {"a": 1.0, "b": 2.0},
+        {"a": 1.0, "b": {"c": 2.0}, "z": 3.0},
+        {"a": 1.0},
+        {"a": 1.0, "b": {"c": 2.0, "d": 3.0}},
+    ],
+)
+def test_invalid_dict_structure(bad_dict: dict):
+    """Tests that dicts not matching the structure of the first push are rejected."""
+    memory = DictReplayBufferWrapper(FlatReplayBuffer(mem_size=5, mode="numpy"))
+    memory.push([{"a": 1.0, "b": {"c": 2.0}}])
+
+    with pytest.raises(MemorialException):
+        memory.push([bad_dict])
+
+
 @pytest.mark.parametrize(
     "random_rollover, mode, device, store_on_device, use_dict",
     ALL_CONFIGURATIONS,
@@ -2,10 +2,13 @@
 
 from __future__ import annotations
 
+import threading
+
 import numpy as np
 import pytest
 from utils import are_equivalent
 
+from memorial.utils import prefetch_iter
 from memorial.wrappers import listed_dict_to_dicted_list
 
 
@@ -50,3 +53,44 @@ def test_dicted_list_to_listed_dict(stack: bool) -> None:
     assert are_equivalent(
         target_dicted_list, created_dicted_list
     ), f"Expected {target_dicted_list=} to equal {created_dicted_list=}."
+
+
+def test_prefetch_iter() -> None:
+    """Tests that prefetch_iter prefetches eagerly, preserves order and forwards exceptions."""
+    # the first item should be produced before it is asked for
+    produced = threading.Event()
+
+    def _flagging_generator():
+        produced.set()
+        yield 0
+
+    prefetched = prefetch_iter(_flagging_generator())
+    assert produced.wait(timeout=5.0), "Expected the first item to be produced eagerly."
+    assert list(prefetched) == [0], "Expected the prefetched item to be yielded."
+
+    # items should come out in the same order
+    items = list(prefetch_iter(range(10)))
+    assert items == list(range(10)), f"Expected {list(range(10))}, got {items}."
+
+    # exceptions in the background should be raised to the consumer
+    def _failing_generator():
+        yield 0
+        raise RuntimeError("failed in the background")
+
+    with pytest.raises(RuntimeError, match="failed in the background"):
+        for _ in prefetch_iter(_failing_generator()):
+            pass
+
+    # exceptions that do not derive from Exception should not hang the consumer
+    def _exiting_generator():
+        yield 0
+        raise SystemExit("exited in the background")
+
+    with pytest.raises(SystemExit, match="exited in the background"):
+        for _ in prefetch_iter(_exiting_generator()):
+            pass
+
+    # stopping early should not hang
+    for item in prefetch_iter(range(10)):
+        if item == 3:
+            break
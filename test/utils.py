@@ -58,6 +58,28 @@ def create_shapes(
         ]
 
 
+def flatten_shapes(
+    shapes: list[tuple[int, ...] | dict[str, Any]] | dict[str, Any],
+) -> list[tuple[int, ...]]:
+    """Flattens a shapes specification into the list of shapes it holds.
+
+    Args:
+        shapes (list[tuple[int, ...] | dict[str, Any]] | dict[str, Any]): shapes
+
+    Returns:
+        list[tuple[int, ...]]:
+
+    """
+    flat_shapes = []
+    for shape in shapes.values() if isinstance(shapes, dict) else shapes:
+        if isinstance(shape, dict):
+            flat_shapes.extend(flatten_shapes(shape))
+        else:
+            flat_shapes.append(shape)
+
+    return flat_shapes
+
+
 def create_memory(
     mem_size: int,
     mode: Literal["numpy", "torch"],
@@ -65,6 +87,7 @@ def create_memory(
     store_on_device: bool,
     random_rollover: bool,
     use_dict: bool,
+    seed: int | None = None,
 ) -> ReplayBuffer:
     """create_memory.
 
@@ -75,6 +98,7 @@ def create_memory(
         store_on_device (bool): store_on_device
         random_rollover (bool): random_rollover
         use_dict (bool): use_dict
+        seed (int | None): seed
 
     Returns:
         ReplayBuffer:
@@ -86,6 +110,7 @@ def create_memory(
         device=device,
         store_on_device=store_on_device,
         random_rollover=random_rollover,
+        seed=seed,
     )
 
     if use_dict: